@@ -10,187 +10,98 @@ Liquidity Premium Monitor (Final Anti-Cache Version)
 - 稳定用于 Notion + jsDelivr（完全无缓存）
 """
 
-import os, sys, json, yaml
+import os, sys
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import matplotlib
-matplotlib.use("Agg")
-import pandas as pd, numpy as np, matplotlib.pyplot as plt
+matplotlib.use("Agg")    # 显式 Agg，避免 GUI 后端探测；pyplot 延迟到绘图时再导入
+import pandas as pd, numpy as np
 from datetime import datetime
 
-try:
-    import akshare as ak
-except ImportError:
-    ak = None
-try:
-    import yfinance as yf
-except ImportError:
-    yf = None
+from lp_core import (normalize_symbol, fetch_daily_data, fetch_many,
+                     resample_ohlcv, compute_indicators, compute_score, compute_lp)
 
 
 # ============================================================
 #  1️⃣ 读取配置
 # ============================================================
 def load_config(path="config.yaml"):
-    if not os.path.exists(path):
+    # PyYAML 只在读配置时用到，延迟导入；libyaml 可用时用 C 实现的 SafeLoader
+    import yaml
+    try:
+        from yaml import CSafeLoader as SafeLoader
+    except ImportError:
+        from yaml import SafeLoader
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return yaml.load(f, Loader=SafeLoader)
+    except FileNotFoundError:
         print(f"[Error] Missing config.yaml at {path}")
         sys.exit(1)
-    with open(path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
 
 
 # ============================================================
-#  2️⃣ 股票代码标准化
+#  2️⃣ 清空目录 / 保存数据
 # ============================================================
-def normalize_symbol(symbol, market, provider):
-    s = symbol.strip().upper()
-    if market == "cn":
-        if provider == "yf":
-            if s.startswith(("6", "9")):
-                return s + ".SS"
-            elif s.startswith(("0", "3")):
-                return s + ".SZ"
-        return s
-    elif market == "hk":
-        if provider == "yf":
-            digits = ''.join([c for c in s if c.isdigit()])
-            return digits.zfill(4) + ".HK"
-        return s.zfill(5)
-    else:
-        return s
-
+def clear_directory(dirpath):
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath, exist_ok=True)
+        return
 
-# ============================================================
-#  3️⃣ 数据获取
-# ============================================================
-def fetch_daily_data(symbol, market, start):
-    df = None
-    if ak and market in ("cn", "hk"):
-        try:
-            sym_ak = normalize_symbol(symbol, market, "ak")
-            if market == "cn":
-                df = ak.stock_zh_a_hist(sym_ak, period="daily",
-                                        start_date=start.replace("-", ""), end_date="")
-                df.rename(columns={"日期": "date", "开盘": "open", "收盘": "close",
-                                   "最高": "high", "最低": "low", "成交量": "volume"}, inplace=True)
-            elif market == "hk":
-                df = ak.stock_hk_hist(sym_ak, period="daily", adjust="")
-                df.rename(columns={"日期": "date", "开盘": "open", "收盘": "close",
-                                   "最高": "high", "最低": "low", "成交量": "volume"}, inplace=True)
-            df["date"] = pd.to_datetime(df["date"])
-            df = df[df["date"] >= pd.to_datetime(start)]
-            df = df[["date", "open", "high", "low", "close", "volume"]]
-        except Exception as e:
-            print(f"[Warn] AkShare fetch failed for {symbol}: {e}")
-            df = None
-
-    if (df is None or df.empty) and yf:
+    # scandir：entry.path 已是拼好的路径，文件类型来自 readdir，无需逐个 join + stat
+    with os.scandir(dirpath) as it:
+        for e in it:
+            if e.is_file():
+                os.remove(e.path)
+                print(f"[DEL] {e.path}")
+
+
+def save_results(df_d, df_w, path_stem, fmt="csv"):
+    """
+    日线 + 周线结果写入同一文件（freq 列区分）
+    - fmt="csv"：默认，docs/ 下发布的格式
+    - fmt="parquet"：pyarrow + zstd，写入更快、体积更小；未安装 pyarrow 时退回 CSV
+    """
+    if fmt == "parquet":
+        path = path_stem + ".parquet"
         try:
-            sym_yf = normalize_symbol(symbol, market, "yf")
-            ticker = yf.Ticker(sym_yf)
-            hist = ticker.history(start=start)
-            df = hist.reset_index().rename(columns={
-                "Date": "date", "Open": "open", "High": "high",
-                "Low": "low", "Close": "close", "Volume": "volume"
-            })
-            df = df[df["date"] >= pd.to_datetime(start)]
-        except Exception as e:
-            print(f"[Error] Yahoo fetch failed for {symbol}: {e}")
-            df = None
-    return df
+            out = pd.concat([df_d.assign(freq="daily"), df_w.assign(freq="weekly")])
+            out.to_parquet(path, engine="pyarrow", compression="zstd", index=False)
+            return path
+        except ImportError as e:
+            print(f"[Warn] Parquet unavailable ({e}), falling back to CSV")
+    # CSV：先写日线再追加周线，不再拼接出第三个 DataFrame
+    path = path_stem + ".csv"
+    df_d.assign(freq="daily").to_csv(path, index=False)
+    df_w.assign(freq="weekly").to_csv(path, index=False, mode="a", header=False)
+    return path
 
 
 # ============================================================
-#  4️⃣ 指标计算
+#  3️⃣ 绘图（带时间戳）
 # ============================================================
-def resample_ohlcv(df, agg="weekly"):
-    if agg == "daily":
-        return df.copy()
-    rule = {"weekly": "W-FRI", "monthly": "ME"}[agg]
-    dfr = df.set_index("date").sort_index()
-    o = dfr["open"].resample(rule).first()
-    h = dfr["high"].resample(rule).max()
-    l = dfr["low"].resample(rule).min()
-    c = dfr["close"].resample(rule).last()
-    v = dfr["volume"].resample(rule).sum()
-    out = pd.concat([o, h, l, c, v], axis=1)
-    out.columns = ["open", "high", "low", "close", "volume"]
-    return out.dropna().reset_index()
-
-
-def compute_indicators(df, agg="daily"):
-    dfa = resample_ohlcv(df, agg)
-    dfa["ret"] = dfa["close"].pct_change()
-
-    short_span, long_span, roll_win = 2, 8, 10
-    ew_short = dfa["volume"].ewm(span=short_span, adjust=False).mean()
-    ew_long = dfa["volume"].ewm(span=long_span, adjust=False).mean()
-    vol_ew_ratio = ew_short / ew_long
-
-    vol_med = dfa["volume"].rolling(roll_win, min_periods=roll_win // 2, center=True).median()
-    vol_rel_med = dfa["volume"] / vol_med
-    vol_component = 0.5 * vol_ew_ratio + 0.5 * vol_rel_med
-    vol_component = vol_component.rolling(2, min_periods=2).mean()
-
-    annual = 252 if agg == "daily" else 52
-    rv_fast = dfa["ret"].rolling(2, min_periods=2).std() * np.sqrt(annual)
-    rv_slow = dfa["ret"].rolling(8, min_periods=4).std() * np.sqrt(annual)
-    vol_ratio = (rv_fast / rv_slow).rolling(2, min_periods=2).mean()
-
-    ma = dfa["close"].rolling(10, min_periods=5).mean()
-    valuation = (dfa["close"] / ma).rolling(2, center=True).mean()
-
-    roll_max = dfa["close"].rolling(10, min_periods=5).max()
-    roll_min = dfa["close"].rolling(10, min_periods=5).min()
-    sentiment = ((dfa["close"] - roll_min) / (roll_max - roll_min)).clip(0, 1)
-    sentiment = sentiment.rolling(2, min_periods=2, center=True).mean()
-
-    dfa["vol_change"] = dfa["volume"].pct_change().clip(-2, 2).fillna(0)
-    dfa["vol_amp"] = vol_component
-    dfa["vol_ratio"] = vol_ratio
-    dfa["valuation"] = valuation
-    dfa["sentiment"] = sentiment
-    return dfa
-
-
-def compute_score(df, w_vol=0.4, w_var=0.3, w_val=0.2, w_sent=0.1):
-    df = df.copy()
-    def norm(s): return s.clip(lower=0.3, upper=4.0)
-    V = norm(df["vol_amp"])
-    R = norm(df["vol_ratio"])
-    VAL = norm(df["valuation"])
-    S = df["sentiment"].fillna(0.5) * 2
-    score = w_vol * V + w_var * R + w_val * VAL + w_sent * S + 0.15 * df["vol_change"]
-    df["lp_score"] = score.rolling(2, min_periods=2, center=True).mean()
-    return df
+_FIG = None
 
 
-# ============================================================
-#  5️⃣ 清空目录
-# ============================================================
-def clear_directory(dirpath):
-    if not os.path.exists(dirpath):
-        os.makedirs(dirpath, exist_ok=True)
-        return
-
-    for f in os.listdir(dirpath):
-        fp = os.path.join(dirpath, f)
-        if os.path.isfile(fp):
-            os.remove(fp)
-            print(f"[DEL] {fp}")
+def _get_figure():
+    """同一进程内复用一个 Figure，避免每只股票重复初始化画布"""
+    global _FIG
+    import matplotlib.pyplot as plt
+    if _FIG is None:
+        _FIG = plt.figure(figsize=(11, 7), constrained_layout=True)
+    _FIG.clear()
+    return _FIG
 
 
-# ============================================================
-#  6️⃣ 绘图（带时间戳）
-# ============================================================
 def plot_dual_panel(df_d, df_w, symbol, market, start, outdir):
-    import matplotlib.pyplot as plt
     cutoff = df_d["date"].max() - pd.Timedelta(days=90)
     df_recent = df_d[df_d["date"] >= cutoff]
+    # 仅用于显示：超过 1500 点时抽稀（步长向上取整，保证不超过 1500 点）
+    df_w = df_w.iloc[::max(1, -(-len(df_w) // 1500))]
 
-    fig, (ax_top, ax_bottom) = plt.subplots(
-        2, 1, figsize=(11, 7),
-        gridspec_kw={'height_ratios': [2, 1.4]},
-        constrained_layout=True
-    )
+    fig = _get_figure()
+    ax_top, ax_bottom = fig.subplots(2, 1, gridspec_kw={'height_ratios': [2, 1.4]})
 
     # --- Weekly ---
     ax_p_top = ax_top
@@ -216,49 +127,82 @@ def plot_dual_panel(df_d, df_w, symbol, market, start, outdir):
     ts = datetime.now().strftime("%Y%m%d_%H")
     out_path = os.path.join(outdir, f"{symbol}_{market}_lp_dual_zoom_{ts}.png")
 
-    fig.savefig(out_path, dpi=200, bbox_inches="tight", facecolor="white")
-    plt.close(fig)
+    fig.savefig(out_path, dpi=150, facecolor="white")
 
     print(f"[IMG] {out_path}")
     return out_path
 
 
 # ============================================================
-#  7️⃣ 主函数
+#  4️⃣ 单只股票处理（可在子进程中运行）
 # ============================================================
-def main():
-    cfg = load_config()
-    output_dir = cfg.get("output_dir", "docs")
+PRICE_COLS = ["open", "high", "low", "close"]
+
+
+def stock_key(stock):
+    return stock["symbol"], stock.get("market", "auto"), stock.get("start", "2015-01-01")
 
-    for stock in cfg.get("stocks", []):
-        symbol = stock["symbol"]
-        market = stock.get("market", "auto")
-        start = stock.get("start", "2015-01-01")
-        display_name = stock.get("name", symbol).replace(" ", "_")
 
-        print(f"\n[Running] {display_name} ({symbol}, {market}) from {start}")
-        df = fetch_daily_data(symbol, market, start)
-        if df is None or df.empty:
-            print(f"[Error] No data for {symbol}")
-            continue
+def process_stock(stock, output_dir, df, output_format="csv"):
+    symbol, market, start = stock_key(stock)
+    display_name = stock.get("name", symbol).replace(" ", "_")
 
-        df_d = compute_score(compute_indicators(df, "daily"))
-        df_w = compute_score(compute_indicators(df, "weekly"))
+    print(f"\n[Running] {display_name} ({symbol}, {market}) from {start}")
+    if df is None or df.empty:
+        print(f"[Error] No data for {symbol}")
+        return None
 
-        stock_dir = os.path.join(output_dir, display_name)
-        clear_directory(stock_dir)    # 🔥 清空文件夹
+    # 价格不足 7 位有效数字，float32 足够；成交量常超过 2^24，保留原精度
+    df = df.astype({c: np.float32 for c in PRICE_COLS})
 
-        os.makedirs(stock_dir, exist_ok=True)
+    # 只排序 / 建索引一次，日线与周线共用
+    df_idx = df.set_index("date").sort_index()
+    df_d = compute_lp(df_idx, "daily")
+    df_w = compute_lp(df_idx, "weekly")
 
-        # 保存 CSV（无时间戳）
-        csv_path = os.path.join(stock_dir, f"{display_name}_{market}_lp_dual.csv")
-        pd.concat([df_d.assign(freq="daily"), df_w.assign(freq="weekly")]).to_csv(csv_path, index=False)
+    stock_dir = os.path.join(output_dir, display_name)
+    clear_directory(stock_dir)    # 🔥 清空文件夹
 
-        # 绘图（带时间戳）
-        png_path = plot_dual_panel(df_d, df_w, display_name, market, start, outdir=stock_dir)
+    os.makedirs(stock_dir, exist_ok=True)
 
-        print(f"[CSV] {csv_path}")
-        print(f"[PNG] {png_path}")
+    # 保存数据（无时间戳）
+    data_path = save_results(df_d, df_w, os.path.join(stock_dir, f"{display_name}_{market}_lp_dual"),
+                             fmt=output_format)
+
+    # 绘图（带时间戳）
+    png_path = plot_dual_panel(df_d, df_w, display_name, market, start, outdir=stock_dir)
+    return data_path, png_path
+
+
+# ============================================================
+#  5️⃣ 主函数（每只股票独立，多进程并行）
+# ============================================================
+def main():
+    cfg = load_config()
+    output_dir = cfg.get("output_dir", "docs")
+    output_format = cfg.get("output_format", "csv")
+    stocks = cfg.get("stocks", [])
+
+    if stocks:
+        print(f"[Fetching] {len(stocks)} stocks ...")
+        data = fetch_many([stock_key(s) for s in stocks])
+
+        # spawn：matplotlib 在 fork 出来的子进程中不安全（macOS）
+        ctx = mp.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(8, len(stocks)), mp_context=ctx) as ex:
+            futs = {ex.submit(process_stock, s, output_dir, data[stock_key(s)], output_format): s for s in stocks}
+            for fut in as_completed(futs):
+                symbol = futs[fut]["symbol"]
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    print(f"[Error] Processing failed for {symbol}: {e}")
+                    continue
+                if result is None:
+                    continue
+                data_path, png_path = result
+                print(f"[DATA] {data_path}")
+                print(f"[PNG] {png_path}")
 
     print("\n✅ All tasks completed.")
 
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Liquidity Premium Monitor — Core
+--------------------------------
+- 股票代码标准化、行情获取（AkShare / Yahoo）
+- 周期重采样、指标与 LP 打分（有 numba 时走单次遍历内核）
+- 不依赖 matplotlib，可被其它脚本直接复用
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import pandas as pd, numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        # 未安装 numba 时退化为普通 Python 函数
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+
+# ============================================================
+#  1️⃣ 股票代码标准化
+# ============================================================
+def normalize_symbol(symbol, market, provider):
+    s = symbol.strip().upper()
+    if market == "cn":
+        if provider == "yf":
+            if s.startswith(("6", "9")):
+                return s + ".SS"
+            elif s.startswith(("0", "3")):
+                return s + ".SZ"
+        return s
+    elif market == "hk":
+        if provider == "yf":
+            digits = ''.join([c for c in s if c.isdigit()])
+            return digits.zfill(4) + ".HK"
+        return s.zfill(5)
+    else:
+        return s
+
+
+# ============================================================
+#  2️⃣ 数据获取
+# ============================================================
+@lru_cache(maxsize=None)
+def _providers():
+    """
+    行情源 (akshare, yfinance, requests_cache)，未安装的为 None
+    只在取数时导入：spawn 子进程重新导入本模块只做计算，不承担这几个重型包的导入开销
+    """
+    try:
+        import akshare as ak
+    except ImportError:
+        ak = None
+    try:
+        import yfinance as yf
+    except ImportError:
+        yf = None
+    try:
+        import requests_cache
+    except ImportError:
+        requests_cache = None
+    return ak, yf, requests_cache
+
+
+def install_http_cache(cache_dir=".cache", expire_after=3600):
+    """
+    用 requests_cache 为 HTTP 请求安装 sqlite 缓存（按 URL + 参数命中，1 小时过期），
+    重复运行时不再重复下载相同的历史K线；未安装 requests_cache 时跳过
+    """
+    requests_cache = _providers()[2]
+    if requests_cache is None or requests_cache.is_installed():
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    requests_cache.install_cache(os.path.join(cache_dir, "http"), expire_after=expire_after)
+
+
+OHLCV_COLS = ["date", "open", "high", "low", "close", "volume"]
+
+
+def _yf_frame(hist):
+    df = hist.dropna(how="all").reset_index().rename(columns={
+        "Date": "date", "Open": "open", "High": "high",
+        "Low": "low", "Close": "close", "Volume": "volume"
+    })
+    # Ticker.history 返回带时区的日期，去掉时区保留当地日期（与 AkShare 一致）
+    if df["date"].dt.tz is not None:
+        df["date"] = df["date"].dt.tz_localize(None)
+    return df[OHLCV_COLS]
+
+
+def fetch_daily_data(symbol, market, start):
+    ak, yf, _ = _providers()
+    start_ts = np.datetime64(start)
+    df = None
+    if ak and market in ("cn", "hk"):
+        try:
+            sym_ak = normalize_symbol(symbol, market, "ak")
+            if market == "cn":
+                df = ak.stock_zh_a_hist(sym_ak, period="daily",
+                                        start_date=start.replace("-", ""), end_date="")
+                df.rename(columns={"日期": "date", "开盘": "open", "收盘": "close",
+                                   "最高": "high", "最低": "low", "成交量": "volume"}, inplace=True)
+            elif market == "hk":
+                df = ak.stock_hk_hist(sym_ak, period="daily", adjust="")
+                df.rename(columns={"日期": "date", "开盘": "open", "收盘": "close",
+                                   "最高": "high", "最低": "low", "成交量": "volume"}, inplace=True)
+            df["date"] = pd.to_datetime(df["date"], format="%Y-%m-%d", cache=True)
+            df = df.loc[df["date"].values >= start_ts, OHLCV_COLS].reset_index(drop=True)
+        except Exception as e:
+            print(f"[Warn] AkShare fetch failed for {symbol}: {e}")
+            df = None
+
+    if (df is None or df.empty) and yf:
+        try:
+            sym_yf = normalize_symbol(symbol, market, "yf")
+            ticker = yf.Ticker(sym_yf)
+            df = _yf_frame(ticker.history(start=start))
+            df = df.loc[df["date"].values >= start_ts].reset_index(drop=True)
+        except Exception as e:
+            print(f"[Error] Yahoo fetch failed for {symbol}: {e}")
+            df = None
+    return df
+
+
+def fetch_many(items):
+    """
+    批量获取多只股票日线，返回 {(symbol, market, start): DataFrame}
+    - Yahoo 优先的代码：按 start 分组，一次 yf.download 批量拉取
+    - AkShare 代码：线程池并发调用 fetch_daily_data
+    """
+    install_http_cache()    # 须在线程池启动前安装
+    ak, yf, _ = _providers()
+    results = {}
+
+    yf_groups, ak_reqs = {}, []
+    for req in items:
+        sym, mkt, start = req
+        if ak and mkt in ("cn", "hk"):
+            ak_reqs.append(req)
+        elif yf:
+            yf_groups.setdefault(start, []).append(req)
+        else:
+            results[req] = None
+
+    for start, reqs in yf_groups.items():
+        syms = {req: normalize_symbol(req[0], req[1], "yf") for req in reqs}
+        try:
+            data = yf.download(" ".join(sorted(set(syms.values()))), start=start,
+                               group_by="ticker", threads=True,
+                               auto_adjust=True, progress=False)
+        except Exception as e:
+            print(f"[Warn] Yahoo batch fetch failed ({start}): {e}")
+            data = None
+        for req, sym_yf in syms.items():
+            df = None
+            if data is not None and not data.empty:
+                try:
+                    hist = data[sym_yf] if isinstance(data.columns, pd.MultiIndex) else data
+                    df = _yf_frame(hist)
+                except Exception as e:
+                    print(f"[Warn] Yahoo batch result missing {req[0]}: {e}")
+                    df = None
+            # 批量结果缺失时退回逐只获取
+            results[req] = df if df is not None and not df.empty else fetch_daily_data(*req)
+
+    if ak_reqs:
+        with ThreadPoolExecutor(max_workers=8) as ex:
+            for req, df in zip(ak_reqs, ex.map(lambda r: fetch_daily_data(*r), ak_reqs)):
+                results[req] = df
+    return results
+
+
+# ============================================================
+#  3️⃣ 指标计算
+# ============================================================
+# 窗口长度为模块级常量：numba 编译时将其视为常数，固定长度的窗口循环可被展开
+SHORT_SPAN, LONG_SPAN = 2, 8          # 成交量 EWMA
+ROLL_WIN = 10                         # 中位数 / 均值 / 高低点窗口
+RV_FAST_WIN, RV_SLOW_WIN = 2, 8       # 波动率窗口
+
+
+def resample_ohlcv(df, agg="weekly"):
+    """df 可为含 date 列的原始日线，也可为已排序、以 date 为索引的日线（避免重复 set_index）"""
+    if isinstance(df.index, pd.DatetimeIndex):
+        dfr = df
+    else:
+        dfr = df.set_index("date").sort_index()
+    if agg == "daily":
+        return dfr.reset_index()
+    rule = {"weekly": "W-FRI", "monthly": "ME"}[agg]
+    o = dfr["open"].resample(rule).first()
+    h = dfr["high"].resample(rule).max()
+    l = dfr["low"].resample(rule).min()
+    c = dfr["close"].resample(rule).last()
+    v = dfr["volume"].resample(rule).sum()
+    out = pd.concat([o, h, l, c, v], axis=1)
+    out.columns = ["open", "high", "low", "close", "volume"]
+    return out.dropna().reset_index()
+
+
+@njit(cache=True, error_model="numpy", inline="always")
+def _window_stats(x, lo, hi):
+    """窗口 x[lo:hi] 内非 NaN 值的 count / mean / std(ddof=1) / max / min"""
+    cnt, tot = 0, 0.0
+    vmax, vmin = -np.inf, np.inf
+    for j in range(lo, hi):
+        v = x[j]
+        if not np.isnan(v):
+            cnt += 1
+            tot += v
+            if v > vmax:
+                vmax = v
+            if v < vmin:
+                vmin = v
+    mean, std = np.nan, np.nan
+    if cnt > 0:
+        mean = tot / cnt
+    if cnt > 1:
+        ss = 0.0
+        for j in range(lo, hi):
+            v = x[j]
+            if not np.isnan(v):
+                ss += (v - mean) * (v - mean)
+        std = np.sqrt(ss / (cnt - 1))
+    return cnt, mean, std, vmax, vmin
+
+
+@njit(cache=True, error_model="numpy", inline="always")
+def _trailing_stats(x, i, w):
+    """
+    尾随窗口 x[i-w+1 : i+1] 的统计量；
+    内部窗口单独成支，w 为编译期常量时循环次数固定，LLVM 可完全展开
+    """
+    if i >= w - 1:
+        return _window_stats(x, i - w + 1, i + 1)
+    return _window_stats(x, 0, i + 1)
+
+
+@njit(cache=True, error_model="numpy")
+def _window_median(x, lo, hi, buf):
+    """窗口 x[lo:hi] 内非 NaN 值的 (count, median)，buf 为排序缓冲区"""
+    cnt = 0
+    for j in range(lo, hi):
+        v = x[j]
+        if not np.isnan(v):
+            # 插入排序（窗口很小）
+            k = cnt
+            while k > 0 and buf[k - 1] > v:
+                buf[k] = buf[k - 1]
+                k -= 1
+            buf[k] = v
+            cnt += 1
+    if cnt == 0:
+        return 0, np.nan
+    if cnt % 2 == 1:
+        return cnt, buf[cnt // 2]
+    return cnt, 0.5 * (buf[cnt // 2 - 1] + buf[cnt // 2])
+
+
+@njit(cache=True, error_model="numpy")
+def _ewm_ratio(x, span_s, span_l):
+    """
+    一次遍历同时计算两条 EWMA(adjust=False) 并返回其比值
+    （递推与 pandas ewm().mean() 相同，包括 NaN 间隔时的权重衰减）
+    """
+    n = x.shape[0]
+    out = np.full(n, np.nan)
+    if n == 0:
+        return out
+    a_s = 2.0 / (span_s + 1)
+    a_l = 2.0 / (span_l + 1)
+    s = x[0]
+    l = x[0]
+    wt_s = 1.0
+    wt_l = 1.0
+    out[0] = s / l
+    for i in range(1, n):
+        cur = x[i]
+        obs = not np.isnan(cur)
+        if not np.isnan(s):
+            wt_s *= 1.0 - a_s
+            wt_l *= 1.0 - a_l
+            if obs:
+                if s != cur:
+                    s = (wt_s * s + a_s * cur) / (wt_s + a_s)
+                if l != cur:
+                    l = (wt_l * l + a_l * cur) / (wt_l + a_l)
+                wt_s = 1.0
+                wt_l = 1.0
+        elif obs:
+            s = cur
+            l = cur
+        out[i] = s / l
+    return out
+
+
+@njit(cache=True, error_model="numpy")
+def _clip(x, lo, hi):
+    """与 Series.clip 相同：NaN 保持为 NaN"""
+    if x < lo:
+        return lo
+    if x > hi:
+        return hi
+    return x
+
+
+@njit(cache=True, error_model="numpy")
+def _lp_pipeline(close, volume, annual, w_vol, w_var, w_val, w_sent):
+    """
+    单次遍历 close / volume，输出与 pandas 版本
+    compute_score(compute_indicators(...)) 一致的
+    ret, vol_change, vol_amp, vol_ratio, valuation, sentiment, lp_score
+    （各分量的相邻两点平滑及打分在同一循环中完成，不再物化中间序列）
+    """
+    n = close.shape[0]
+    sq = np.sqrt(annual)
+    ew_ratio = _ewm_ratio(volume, SHORT_SPAN, LONG_SPAN)
+
+    ret = np.full(n, np.nan)
+    vol_change = np.zeros(n)
+    vol_amp = np.full(n, np.nan)
+    vol_ratio = np.full(n, np.nan)
+    valuation = np.full(n, np.nan)
+    sentiment = np.full(n, np.nan)
+    lp_score = np.full(n, np.nan)
+    buf = np.empty(ROLL_WIN)
+
+    p_vol = p_ratio = p_val = p_sent = p_score = np.nan
+    for i in range(n):
+        if i > 0:
+            ret[i] = close[i] / close[i - 1] - 1.0
+            vc = volume[i] / volume[i - 1] - 1.0
+            vol_change[i] = 0.0 if np.isnan(vc) else _clip(vc, -2.0, 2.0)
+
+        # 成交量：EWMA 比值 + 相对中心化中位数
+        lo = i - ROLL_WIN // 2
+        hi = i + ROLL_WIN - ROLL_WIN // 2
+        if lo >= 0 and hi <= n:
+            cnt, med = _window_median(volume, lo, lo + ROLL_WIN, buf)
+        else:
+            cnt, med = _window_median(volume, max(0, lo), min(n, hi), buf)
+        if cnt < ROLL_WIN // 2:
+            med = np.nan
+        r_vol = 0.5 * ew_ratio[i] + 0.5 * (volume[i] / med)
+
+        # 波动率：rv_fast(2) / rv_slow(8)
+        cnt, _, std_f, _, _ = _trailing_stats(ret, i, RV_FAST_WIN)
+        rv_fast = std_f * sq if cnt >= RV_FAST_WIN else np.nan
+        cnt, _, std_s, _, _ = _trailing_stats(ret, i, RV_SLOW_WIN)
+        rv_slow = std_s * sq if cnt >= RV_SLOW_WIN // 2 else np.nan
+        r_ratio = rv_fast / rv_slow
+
+        # 估值 / 情绪：10 日均值、最高、最低
+        cnt, ma, _, hi_c, lo_c = _trailing_stats(close, i, ROLL_WIN)
+        if cnt < ROLL_WIN // 2:
+            ma, hi_c, lo_c = np.nan, np.nan, np.nan
+        r_val = close[i] / ma
+        r_sent = _clip((close[i] - lo_c) / (hi_c - lo_c), 0.0, 1.0)
+
+        # 相邻两点平滑 + 打分（NaN 自然传播，等价于 min_periods=2）
+        score = np.nan
+        if i > 0:
+            vol_amp[i] = 0.5 * (p_vol + r_vol)
+            vol_ratio[i] = 0.5 * (p_ratio + r_ratio)
+            valuation[i] = 0.5 * (p_val + r_val)
+            sentiment[i] = 0.5 * (p_sent + r_sent)
+            sent = 0.5 if np.isnan(sentiment[i]) else sentiment[i]
+            score = (w_vol * _clip(vol_amp[i], 0.3, 4.0) + w_var * _clip(vol_ratio[i], 0.3, 4.0)
+                     + w_val * _clip(valuation[i], 0.3, 4.0) + w_sent * sent * 2
+                     + 0.15 * vol_change[i])
+            lp_score[i] = 0.5 * (p_score + score)
+        p_vol, p_ratio, p_val, p_sent, p_score = r_vol, r_ratio, r_val, r_sent, score
+
+    return ret, vol_change, vol_amp, vol_ratio, valuation, sentiment, lp_score
+
+
+def _window_view(x, window, center=False):
+    """
+    以 NaN 补齐后的 sliding_window_view，第 i 行即 rolling 的第 i 个窗口
+    （center=True 时窗口为 [i - window//2, i + window - 1 - window//2]，与 pandas 一致）
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if x.size == 0:
+        return np.empty((0, window))
+    left = window // 2 if center else window - 1
+    xp = np.concatenate([np.full(left, np.nan), x, np.full(window - 1 - left, np.nan)])
+    return sliding_window_view(xp, window)
+
+
+def _rolling_reduce(x, window, min_periods, func, center=False, **kwargs):
+    """等价于 Series.rolling(window, min_periods, center).<func>()"""
+    w = _window_view(x, window, center)
+    valid = (~np.isnan(w)).sum(axis=1) >= min_periods
+    out = np.full(w.shape[0], np.nan)
+    out[valid] = func(w[valid], axis=1, **kwargs)
+    return out
+
+
+def _rolling_median(x, window, min_periods, center=False):
+    """
+    等价于 Series.rolling(...).median()：
+    完整窗口用 np.partition 取中间两位（O(W)），含 NaN 的边缘窗口退回 nanmedian
+    """
+    w = _window_view(x, window, center)
+    cnt = (~np.isnan(w)).sum(axis=1)
+    out = np.full(w.shape[0], np.nan)
+
+    full = cnt == window
+    lo, hi = (window - 1) // 2, window // 2
+    part = np.partition(w[full], (lo, hi), axis=1)
+    out[full] = 0.5 * (part[:, lo] + part[:, hi])
+
+    partial = ~full & (cnt >= min_periods)
+    out[partial] = np.nanmedian(w[partial], axis=1)
+    return out
+
+
+def compute_indicators(df, agg="daily"):
+    dfa = resample_ohlcv(df, agg)
+    annual = 252 if agg == "daily" else 52
+
+    if HAVE_NUMBA:
+        # 只取指标分量，lp_score 丢弃（权重无关）
+        ret, vol_change, vol_amp, vol_ratio, valuation, sentiment, _ = _lp_pipeline(
+            dfa["close"].to_numpy(), dfa["volume"].to_numpy(np.float64), annual, 0.0, 0.0, 0.0, 0.0)
+        return dfa.assign(ret=ret, vol_change=vol_change, vol_amp=vol_amp,
+                          vol_ratio=vol_ratio, valuation=valuation, sentiment=sentiment)
+
+    ret = dfa["close"].pct_change()
+
+    ew_short = dfa["volume"].ewm(span=SHORT_SPAN, adjust=False).mean()
+    ew_long = dfa["volume"].ewm(span=LONG_SPAN, adjust=False).mean()
+    vol_ew_ratio = ew_short / ew_long
+
+    vol_med = _rolling_median(dfa["volume"].to_numpy(), ROLL_WIN, ROLL_WIN // 2, center=True)
+    vol_rel_med = dfa["volume"] / vol_med
+    vol_component = 0.5 * vol_ew_ratio + 0.5 * vol_rel_med
+    vol_component = vol_component.rolling(2, min_periods=2).mean()
+
+    rv_fast = pd.Series(_rolling_reduce(ret, RV_FAST_WIN, RV_FAST_WIN, np.nanstd, ddof=1), index=dfa.index) * np.sqrt(annual)
+    rv_slow = pd.Series(_rolling_reduce(ret, RV_SLOW_WIN, RV_SLOW_WIN // 2, np.nanstd, ddof=1), index=dfa.index) * np.sqrt(annual)
+    vol_ratio = (rv_fast / rv_slow).rolling(2, min_periods=2).mean()
+
+    ma = dfa["close"].rolling(ROLL_WIN, min_periods=ROLL_WIN // 2).mean()
+    valuation = (dfa["close"] / ma).rolling(2, center=True).mean()
+
+    close = dfa["close"].to_numpy()
+    roll_max = _rolling_reduce(close, ROLL_WIN, ROLL_WIN // 2, np.nanmax)
+    roll_min = _rolling_reduce(close, ROLL_WIN, ROLL_WIN // 2, np.nanmin)
+    sentiment = ((dfa["close"] - roll_min) / (roll_max - roll_min)).clip(0, 1)
+    sentiment = sentiment.rolling(2, min_periods=2, center=True).mean()
+
+    vol_change = dfa["volume"].pct_change().clip(-2, 2).fillna(0)
+    return dfa.assign(ret=ret, vol_change=vol_change, vol_amp=vol_component,
+                      vol_ratio=vol_ratio, valuation=valuation, sentiment=sentiment)
+
+
+def compute_score(df, w_vol=0.4, w_var=0.3, w_val=0.2, w_sent=0.1):
+    V, R, VAL = np.clip(df[["vol_amp", "vol_ratio", "valuation"]].to_numpy(np.float64), 0.3, 4.0).T
+    S = np.nan_to_num(df["sentiment"].to_numpy(np.float64), nan=0.5) * 2
+    score = w_vol * V + w_var * R + w_val * VAL + w_sent * S + 0.15 * df["vol_change"].to_numpy(np.float64)
+    # rolling(2, min_periods=2, center=True).mean()：相邻两点均值
+    lp_score = np.full(score.shape[0], np.nan)
+    lp_score[1:] = 0.5 * (score[1:] + score[:-1])
+    return df.assign(lp_score=lp_score)
+
+
+def compute_lp(df, agg="daily", w_vol=0.4, w_var=0.3, w_val=0.2, w_sent=0.1):
+    """compute_score(compute_indicators(df, agg)) 的融合版本：有 numba 时单次遍历完成"""
+    if not HAVE_NUMBA:
+        return compute_score(compute_indicators(df, agg), w_vol, w_var, w_val, w_sent)
+    dfa = resample_ohlcv(df, agg)
+    annual = 252 if agg == "daily" else 52
+    ret, vol_change, vol_amp, vol_ratio, valuation, sentiment, lp_score = _lp_pipeline(
+        dfa["close"].to_numpy(), dfa["volume"].to_numpy(np.float64), annual,
+        w_vol, w_var, w_val, w_sent)
+    return dfa.assign(ret=ret, vol_change=vol_change, vol_amp=vol_amp, vol_ratio=vol_ratio,
+                      valuation=valuation, sentiment=sentiment, lp_score=lp_score)
@@ -7,41 +7,83 @@ Push LP Monitor PNGs to Notion (Right-side Outline Version)
 - 与期货版 push_to_notion 一致
 - 每个股票使用 heading_2，Notion 自动生成右侧目录
 - 找最新 *_YYYYMMDD_HH.png
-- CDN: jsDelivr（无缓存问题）
+- CDN: jsDelivr（无缓存问题），可用环境变量 BASE_URL 覆盖
 """
 
 import os
-import yaml
-from datetime import datetime
-from notion_client import Client
-import glob
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import chain, islice
+import fnmatch
 
 # -----------------------------
-# 固定 CDN 路径
+# CDN 路径（默认 jsDelivr；secret 未配置时为空串，同样回落默认）
 # -----------------------------
-BASE_CDN = "https://cdn.jsdelivr.net/gh/CMUJIN/liquidity-premium-monitor@main/docs"
+BASE_URL = os.getenv("BASE_URL") or "https://cdn.jsdelivr.net/gh/CMUJIN/liquidity-premium-monitor@main/docs"
 
 NOTION_TOKEN = os.getenv("NOTION_TOKEN")
 NOTION_PAGE = os.getenv("NOTION_PAGE_ID")
 
-notion = Client(auth=NOTION_TOKEN)
+NOTION_MAX_CHILDREN = 100    # blocks.children.append / list 单次上限
+SKIP_DIRS = {"__pycache__", "node_modules"}    # 另外跳过所有点目录（.git / .venv 等）
+# 推送状态含 block id，不能放进会被提交、经 CDN 公开的 docs/；
+# .cache/ 已在 .gitignore 中，CI 里由 actions/cache 跨运行保留
+STATE_FILE = os.path.join(".cache", "notion_state.json")
 
 
 # -----------------------------
 # Utility
 # -----------------------------
-def get_latest(pattern):
-    """匹配 *_YYYYMMDD_HH.png"""
-    lst = glob.glob(pattern)
+def load_config(path="config.yaml"):
+    # PyYAML 只在读配置时用到，延迟导入；libyaml 可用时用 C 实现的 SafeLoader
+    import yaml
+    try:
+        from yaml import CSafeLoader as SafeLoader
+    except ImportError:
+        from yaml import SafeLoader
+
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.load(f, Loader=SafeLoader)
+
+
+def scan_stock_dirs(outdir):
+    """
+    一次 scandir 列出所有股票子目录（跳过隐藏 / 缓存类目录）
+    follow_symlinks=False：直接用 readdir 返回的类型，不为符号链接再做 stat
+    """
+    with os.scandir(outdir) as it:
+        return sorted(
+            e.name for e in it
+            if not e.name.startswith(".") and e.name not in SKIP_DIRS
+            and e.is_dir(follow_symlinks=False)
+        )
+
+
+def scan_pngs(stock_dir):
+    """一次 scandir 列出目录下所有 PNG（DirEntry，按需再 stat；跳过符号链接）"""
+    with os.scandir(stock_dir) as it:
+        return [e for e in it if e.name.rpartition(".")[2] == "png" and e.is_file(follow_symlinks=False)]
+
+
+def get_latest(pngs, pattern):
+    """
+    匹配 *_YYYYMMDD_HH.png，按文件名取最新：
+    时间戳定长补零，字典序即时间序，无需逐个 stat
+    """
+    lst = [e for e in pngs if fnmatch.fnmatch(e.name, pattern)]
     if not lst:
         return None
-    return max(lst, key=os.path.getmtime)
+    return max(lst, key=lambda e: e.name)
 
 
-def file_time(path):
-    if not path or not os.path.exists(path):
+def file_time(mtime):
+    if mtime is None:
         return "N/A"
-    return datetime.fromtimestamp(os.path.getmtime(path)).strftime("%Y-%m-%d %H:%M:%S")
+    # time.localtime 直接走 C 实现，不构造 datetime 对象
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime))
 
 
 def safe_heading(text):
@@ -64,80 +106,276 @@ def safe_para(text):
     }
 
 
+def safe_image(url):
+    return {
+        "object": "block",
+        "type": "image",
+        "image": {"type": "external", "external": {"url": url}}
+    }
+
+
+# -----------------------------
+# 推送状态（内容未变则跳过）
+# -----------------------------
+def blocks_fingerprint(blocks):
+    """待推送内容的指纹：blocks 规范化 JSON 的 BLAKE2b"""
+    payload = json.dumps(blocks, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def page_key(page_id):
+    """页面 id 是 secret：状态里只存它的 BLAKE2b 摘要"""
+    return hashlib.blake2b((page_id or "").encode("utf-8"), digest_size=16).hexdigest()
+
+
+def load_state(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_state(path, state):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+
+
+# -----------------------------
+# Notion Client
+# -----------------------------
+def make_client():
+    """
+    整轮共用一个 Client 及其 httpx 连接池（线程安全）：
+    连接数与删除线程池一致，TLS 握手只做一次，后续 delete / append 复用。
+    notion_client / httpx 在这里才导入，扫描与构建 block 不依赖它们。
+    """
+    import httpx
+    from notion_client import Client
+
+    # h2 为可选依赖：装了就走 HTTP/2 多路复用，否则 HTTP/1.1 keep-alive
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+
+    return Client(
+        auth=NOTION_TOKEN,
+        client=httpx.Client(
+            http2=http2,
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=16),
+        ),
+    )
+
+
 # -----------------------------
 # 清空 Notion 页面
 # -----------------------------
-def clear_page(page_id):
+def delete_block(notion, block_id):
+    """单个 block 删除失败（如 429 / 404）只记录，不影响其它删除；失败时返回该 id"""
     try:
-        children = notion.blocks.children.list(page_id)["results"]
-        for c in children:
-            # 保留子页面 / 数据库
-            if c["type"] in ("child_page", "child_database"):
-                continue
-            notion.blocks.delete(c["id"])
-        print("[INFO] Notion page cleared.")
+        notion.blocks.delete(block_id)
+    except Exception as e:
+        print(f"[WARN] delete {block_id} failed: {e}")
+        return block_id
+    return None
+
+
+def delete_blocks(notion, block_ids):
+    """
+    逐个 DELETE 是纯网络等待，并发执行；block_ids 可以是惰性迭代器
+    返回删除失败的 id 列表
+    """
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        return [bid for bid in ex.map(partial(delete_block, notion), block_ids) if bid]
+
+
+def iter_children(notion, page_id):
+    """按游标分页遍历全部子 block（单次 list 最多返回 100 个）"""
+    kwargs = {"page_size": NOTION_MAX_CHILDREN}
+    while True:
+        resp = notion.blocks.children.list(page_id, **kwargs)
+        yield from resp["results"]
+        if not resp.get("has_more"):
+            return
+        kwargs["start_cursor"] = resp["next_cursor"]
+
+
+def clear_page(notion, page_id):
+    """清空页面（保留子页面 / 数据库）；全部删除成功返回 True"""
+    try:
+        # 边翻页边提交删除
+        failed = delete_blocks(notion, (c["id"] for c in iter_children(notion, page_id)
+                                        if c["type"] not in ("child_page", "child_database")))
     except Exception as e:
         print(f"[WARN] clear_page failed: {e}")
+        return False
+    if failed:
+        print(f"[WARN] clear_page left {len(failed)} block(s) on the page")
+        return False
+    print("[INFO] Notion page cleared.")
+    return True
 
 
 # -----------------------------
-# 主构建逻辑（与期货版一致）
+# 分批追加
 # -----------------------------
-def push_to_notion():
+def chunks(iterable, n):
+    """任意可迭代对象按 n 个一组切分，惰性消费，不要求先物化成列表"""
+    it = iter(iterable)
+    while chunk := list(islice(it, n)):
+        yield chunk
+
+
+def append_blocks(notion, page_id, blocks, after=None):
+    """
+    按 ≤100 一批追加，返回新建 block 的 id 列表。
+    blocks 可以是生成器：每次只取出一批，构建与网络请求交替进行。
+    after 为空时第一批追加到页尾，否则插到该 block 之后；
+    后一批用 after 锚定到上一批最后一个 block，保证顺序不依赖“追加到末尾”的语义。
+    锚点来自上一批的返回值，因此各批只能顺序提交。
+    """
+    ids = []
+    for chunk in chunks(blocks, NOTION_MAX_CHILDREN):
+        kwargs = {"children": chunk}
+        if after:
+            kwargs["after"] = after
+        resp = notion.blocks.children.append(page_id, **kwargs)
+        ids.extend(b["id"] for b in resp["results"])
+        after = ids[-1]
+    return ids
 
-    cfg = yaml.safe_load(open("config.yaml", "r", encoding="utf-8"))
-    outdir = cfg.get("output_dir", "docs")
-
-    # 扫描所有股票子目录
-    stocks = []
-    for name in os.listdir(outdir):
-        d = os.path.join(outdir, name)
-        if os.path.isdir(d):
-            stocks.append(name)
 
-    stocks = sorted(stocks)
-    print(f"[INFO] Found stocks: {stocks}")
-
-    # 清空 Notion 页面
-    clear_page(NOTION_PAGE)
+# -----------------------------
+# 按股票分段增量同步
+# -----------------------------
+def section_state(sections, ids):
+    """把连续追加得到的 id 按段切开：[{"stock", "fingerprint", "ids"}]"""
+    out, pos = [], 0
+    for stock, blocks, fp in sections:
+        out.append({"stock": stock, "fingerprint": fp, "ids": ids[pos:pos + len(blocks)]})
+        pos += len(blocks)
+    return out
+
+
+def sync_sections(notion, page_id, new, old):
+    """
+    只改动内容变化的股票段，返回新的分段状态。
+    new：[(stock, blocks, fingerprint)]，按页面顺序
+    old：上次推送记录的分段状态
+    - 指纹未变的段原样保留
+    - 新增 / 变化的相邻段合并为一批，用 after 插到前一个保留段之后
+    - 被替换 / 移除的旧段最后统一删除
+    页面最前面需要插入、又没有可用锚点时抛 LookupError，旧 block 删除失败时抛 RuntimeError，
+    均由调用方整页重建
+    """
+    old_by_stock = {sec["stock"]: sec for sec in old}
+    old_pos = {sec["stock"]: i for i, sec in enumerate(old)}
+    kept = {stock for stock, _, fp in new
+            if old_by_stock.get(stock, {}).get("fingerprint") == fp}
+
+    state, anchor, i = [], None, 0
+    while i < len(new):
+        stock, _, fp = new[i]
+        if stock in kept:
+            ids = old_by_stock[stock]["ids"]
+            state.append({"stock": stock, "fingerprint": fp, "ids": ids})
+            anchor = ids[-1]
+            i += 1
+            continue
+
+        # 收集到下一个保留段为止的连续一批
+        j = i
+        while j < len(new) and new[j][0] not in kept:
+            j += 1
+        run = new[i:j]
+
+        after = anchor
+        if after is None:
+            # 前面没有保留段：锚到下一个保留段之前的旧段末尾（这些旧段稍后会被删除）
+            stop = old_pos[new[j][0]] if j < len(new) else len(old)
+            if stop == 0:
+                raise LookupError("no anchor block before the first kept section")
+            after = old[stop - 1]["ids"][-1]
+
+        ids = append_blocks(notion, page_id, (b for _, blocks, _ in run for b in blocks), after=after)
+        state.extend(section_state(run, ids))
+        anchor = ids[-1]
+        i = j
+
+    failed = delete_blocks(notion, (bid for sec in old if sec["stock"] not in kept for bid in sec["ids"]))
+    if failed:
+        # 删不掉的旧 block 不在新状态里，之后的增量同步再也找不到它：交给整页重建重新列出清理
+        raise RuntimeError(f"{len(failed)} stale block(s) could not be deleted")
+    return state
 
-    blocks = []
 
-    for stock in stocks:
+# -----------------------------
+# 主构建逻辑（与期货版一致）
+# -----------------------------
+def stock_blocks(outdir, stock):
+    """单个股票的 block 序列：标题 + 更新时间 + 最新 trend_v6 / lp_dual_zoom 图"""
+    pngs = scan_pngs(os.path.join(outdir, stock))
 
-        # ===== 寻找最新 trend_v6 图 =====
-        trend_path = get_latest(f"{outdir}/{stock}/{stock}_trend_v6*.png")
-        trend_file = os.path.basename(trend_path) if trend_path else None
-        trend_url = f"{BASE_CDN}/{stock}/{trend_file}" if trend_file else None
+    trend = get_latest(pngs, f"{stock}_trend_v6*.png")
+    lp = get_latest(pngs, f"{stock}_*_lp_dual_zoom*.png")
 
-        # ===== 寻找最新 lp_dual_zoom 图 =====
-        lp_path = get_latest(f"{outdir}/{stock}/{stock}_*_lp_dual_zoom*.png")
-        lp_file = os.path.basename(lp_path) if lp_path else None
-        lp_url = f"{BASE_CDN}/{stock}/{lp_file}" if lp_file else None
+    return [
+        # Header （右侧目录由这个自动生成）
+        safe_heading(f"📈 {stock} LP Monitor"),
+        safe_para(f"🕒 Updated: {file_time(lp.stat(follow_symlinks=False).st_mtime if lp else None)}"),
+        *(safe_image(f"{BASE_URL}/{stock}/{e.name}") for e in (trend, lp) if e),
+    ]
 
-        # ===== Header （右侧目录由这个自动生成）=====
-        blocks.append(safe_heading(f"📈 {stock} LP Monitor"))
 
-        blocks.append(safe_para(f"🕒 Updated: {file_time(lp_path)}"))
+def push_to_notion():
 
-        # ===== Trend 图片 =====
-        if trend_url:
-            blocks.append({
-                "object": "block",
-                "type": "image",
-                "image": {"type": "external", "external": {"url": trend_url}}
-            })
+    cfg = load_config()
+    outdir = cfg.get("output_dir", "docs")
 
-        # ===== LP Zoom 图片 =====
-        if lp_url:
-            blocks.append({
-                "object": "block",
-                "type": "image",
-                "image": {"type": "external", "external": {"url": lp_url}}
-            })
+    # 扫描所有股票子目录
+    stocks = scan_stock_dirs(outdir)
+    print(f"[INFO] Found stocks: {stocks}")
 
-    # 一次性追加
-    notion.blocks.children.append(NOTION_PAGE, children=blocks)
+    # 每个股票目录一次 scandir + 至多一次 stat；docs/ 在网络盘上时可并发扫描，重叠往返延迟
+    workers = int(cfg.get("scan_workers", 1))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            per_stock = list(zip(stocks, ex.map(partial(stock_blocks, outdir), stocks)))
+    else:
+        per_stock = [(s, stock_blocks(outdir, s)) for s in stocks]
+    sections = [(s, b, blocks_fingerprint(b)) for s, b in per_stock]
+
+    # 与上次推送内容一致则跳过整轮删除 / 追加
+    prev = load_state(STATE_FILE)
+    # 整页指纹由各段指纹组合而来，无需再拼一份完整的 blocks 列表
+    state = {"page": page_key(NOTION_PAGE), "fingerprint": blocks_fingerprint([fp for _, _, fp in sections])}
+    if prev.get("page") == state["page"] and prev.get("fingerprint") == state["fingerprint"]:
+        print("[Skip] no changes")
+        return
+
+    notion = make_client()
+
+    # 同一页面且有分段记录：只同步变化的股票段；任何失败都回落整页重建
+    if prev.get("page") == state["page"] and prev.get("sections"):
+        try:
+            state["sections"] = sync_sections(notion, NOTION_PAGE, sections, prev["sections"])
+            print("[INFO] Notion page updated incrementally.")
+        except Exception as e:
+            print(f"[WARN] incremental update failed, rebuilding page: {e}")
+
+    if "sections" not in state:
+        # 清空 Notion 页面
+        cleared = clear_page(notion, NOTION_PAGE)
+        blocks = chain.from_iterable(b for _, b, _ in sections)
+        state["sections"] = section_state(sections, append_blocks(notion, NOTION_PAGE, blocks))
+        if not cleared:
+            # 页面上有残留的旧 block：不记录指纹与分段，下一轮不跳过、直接整页重建，重新列出并清理
+            state = {"page": state["page"]}
+
+    save_state(STATE_FILE, state)
     print("[DONE] LP monitor pushed to Notion with right-side outline.")
 
 